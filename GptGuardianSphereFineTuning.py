@@ -6,6 +6,7 @@ from flask_cors import CORS
 from pymongo import MongoClient
 import requests
 import json
+from message_storage import encode_messages, decode_messages
 
 # Load emergency data from JSON file
 with open("data/emergency_numbers.json", "r", encoding="utf-8") as f:
@@ -30,7 +31,8 @@ CORS(app, resources={
     r"/*": {
         "origins": ['https://guardian-sphere.azurewebsites.net','http://localhost:3000', 'https://guardianspheres.com' ],  # Allow requests from your frontend
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],  # Include PUT
-        "allow_headers": ["Content-Type", "Authorization"],  # Allow necessary headers
+        "allow_headers": ["Content-Type", "Authorization", "If-None-Match"],  # Allow necessary headers
+        "expose_headers": ["ETag"],  # Let the frontend read ETags for conditional requests
         "supports_credentials": True
     }
 })
@@ -193,6 +195,55 @@ def detect_language(text):
         return "he"
     return "en"
 
+#delta responses
+def assign_sequence_numbers(chat_messages):
+    """
+    Gives every message a sequence number (1, 2, 3, ...) in conversation order.
+    Messages saved before sequence numbers existed get their position in the history.
+    """
+    for index, msg in enumerate(chat_messages, start=1):
+        msg.setdefault("seq", index)
+    return chat_messages
+def next_sequence_number(chat_messages):
+    """
+    Returns the sequence number to use for the next message appended to the chat.
+    """
+    if not chat_messages:
+        return 1
+    return chat_messages[-1]["seq"] + 1
+def parse_since_seq(value):
+    """
+    Parses the client's last known sequence number, from the JSON body (int) or the query string (str).
+    Returns None when absent (full history requested), raises ValueError when invalid.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        since_seq = int(value)
+    elif isinstance(value, int) and not isinstance(value, bool):
+        since_seq = value
+    else:
+        raise ValueError("sinceSeq must be a non-negative integer")
+    if since_seq < 0:
+        raise ValueError("sinceSeq must be a non-negative integer")
+    return since_seq
+def messages_since(chat_messages, since_seq):
+    """
+    Returns only the messages the client has not seen yet.
+    When since_seq is None the whole history is returned (backward compatible).
+    """
+    if since_seq is None:
+        return chat_messages
+    return [msg for msg in chat_messages if msg["seq"] > since_seq]
+def conditional_response(payload):
+    """
+    Builds a JSON response with an ETag and answers 304 Not Modified
+    when it matches the client's If-None-Match header.
+    """
+    response = jsonify(payload)
+    response.add_etag()
+    return response.make_conditional(request)
+
 
 
 
@@ -253,6 +304,12 @@ def chat():
         user_message = request.json.get("message", "").strip()
         country_code = request.json.get("country", "default")  # Country code for emergency response
 
+        # Optional delta protocol: only return messages after the client's last known sequence
+        try:
+            since_seq = parse_since_seq(request.json.get("sinceSeq"))
+        except (TypeError, ValueError):
+            return jsonify({"error": "sinceSeq must be a non-negative integer"}), 400
+
         # Log the received data
         print("Received data:", {"username": username, "chat_id": chat_id, "user_message": user_message})
 
@@ -279,19 +336,25 @@ def chat():
             emergency_message = emergency_response(country_code, language)
 
             # Append the emergency message to the chat history
-            chat_messages = chat.get("messages", [])
-            chat_messages.append({"role": "assistant", "content": emergency_message})
+            stored_messages = chat.get("messages", [])
+            chat_messages = assign_sequence_numbers(decode_messages(stored_messages))
+            chat_messages.append({
+                "seq": next_sequence_number(chat_messages),
+                "role": "assistant",
+                "content": emergency_message
+            })
 
             # Save the updated chat messages in the database
             chat_collection.update_one(
                 {"_id": chat_id, "username": username},
-                {"$set": {"messages": chat_messages}}
+                {"$set": {"messages": encode_messages(chat_messages, stored_messages)}}
             )
 
             # Return the emergency response
             return jsonify({
                 "response": emergency_message,  # The emergency message
-                "messages": chat_messages  # The updated chat history
+                "messages": messages_since(chat_messages, since_seq),  # The updated chat history (or delta)
+                "lastSeq": chat_messages[-1]["seq"]
             }), 200
 
         # Detect user role (non-emergency)
@@ -302,7 +365,8 @@ def chat():
             print(f"Role {role} saved to database.")
 
         # Get the message history
-        chat_messages = chat.get("messages", [])
+        stored_messages = chat.get("messages", [])
+        chat_messages = assign_sequence_numbers(decode_messages(stored_messages))
         print("Chat messages:", chat_messages)
 
         # Prepare GPT context
@@ -341,20 +405,22 @@ def chat():
             ai_message = generate_role_based_response(role, ai_message)
 
         # Save the new messages
+        user_seq = next_sequence_number(chat_messages)
         chat_messages.extend([
-            {"role": "user", "content": user_message},
-            {"role": "assistant", "content": ai_message}
+            {"seq": user_seq, "role": "user", "content": user_message},
+            {"seq": user_seq + 1, "role": "assistant", "content": ai_message}
         ])
         chat_collection.update_one(
             {"_id": chat_id, "username": username},
-            {"$set": {"messages": chat_messages}}
+            {"$set": {"messages": encode_messages(chat_messages, stored_messages)}}
         )
         print("Messages saved to database.")
 
         # Return the AI response
         return jsonify({
             "response": ai_message,  # The AI-generated response
-            "messages": chat_messages  # The updated chat history
+            "messages": messages_since(chat_messages, since_seq),  # The updated chat history (or delta)
+            "lastSeq": chat_messages[-1]["seq"]
         })
 
     except requests.exceptions.RequestException as azure_error:
@@ -375,11 +441,36 @@ def get_chat_history(username):
             {
                 "_id": chat["_id"],
                 "title": chat["title"],
-                "messages": chat["messages"]
+                "messages": assign_sequence_numbers(decode_messages(chat["messages"]))
             }
             for chat in chats
         ]
-        return jsonify({"history": history})
+        return conditional_response({"history": history})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/history/<username>/<chat_id>", methods=["GET", "OPTIONS"])
+def get_chat(username, chat_id):
+    if request.method == "OPTIONS":
+        return {}, 200
+
+    try:
+        try:
+            since_seq = parse_since_seq(request.args.get("sinceSeq"))
+        except ValueError:
+            return jsonify({"error": "sinceSeq must be a non-negative integer"}), 400
+
+        chat = chat_collection.find_one({"_id": chat_id, "username": username})
+        if not chat:
+            return jsonify({"error": "Chat not found"}), 404
+
+        chat_messages = assign_sequence_numbers(decode_messages(chat.get("messages", [])))
+        return conditional_response({
+            "_id": chat["_id"],
+            "title": chat["title"],
+            "messages": messages_since(chat_messages, since_seq),
+            "lastSeq": chat_messages[-1]["seq"] if chat_messages else 0
+        })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -0,0 +1,153 @@
+import argparse
+import os
+import tempfile
+import time
+import bson
+from concurrent.futures import ThreadPoolExecutor
+
+import message_storage
+from message_storage import encode_messages, decode_messages, MESSAGE_UNCOMPRESSED_TAIL
+from train_message_dictionary import load_corpus_messages, load_mongo_chats, train_dictionary
+
+# Compares the legacy message schema with the compact/zstd one.
+# Usage: python benchmark_message_storage.py [--from-mongo]
+#   (default)     trains a temporary dictionary on part of the training prompts and measures chats
+#                 built only from the held-out prompts, so the dictionary has never seen them
+#   --from-mongo  measures the real chats in MONGO_URI against the deployed MESSAGE_DICTIONARY_PATH
+#
+# BSON size is what MongoDB stores and what every find_one in chat() sends over the network.
+# Read time is BSON decode + decode_messages, what chat() and history do on every read.
+
+CHAT_LENGTHS = [10, 20, 50, 100, 200]
+MONGO_BUCKETS = [(1, 10), (11, 20), (21, 50), (51, 100), (101, None)]
+HOLDOUT_EVERY = 4  # every 4th prompt is kept out of the dictionary training
+READ_ROUNDS = 200
+
+# waitress serves requests on several threads, report whether encode/decode round trips there
+CONCURRENT_THREADS = 8
+CONCURRENT_ROUNDS = 50
+
+
+def build_chat(contents, length):
+    """
+    Builds a user/assistant conversation of `length` messages by cycling through the corpus.
+    """
+    return [
+        {
+            "seq": index + 1,
+            "role": "user" if index % 2 == 0 else "assistant",
+            "content": contents[index % len(contents)]
+        }
+        for index in range(length)
+    ]
+def encode_document(messages):
+    return bson.encode({"_id": "00000000-0000-0000-0000-000000000000", "messages": messages})
+def time_read(documents):
+    """
+    Average time (ms) to read one stored chat: BSON decode + decode_messages.
+    """
+    start = time.perf_counter()
+    for _ in range(READ_ROUNDS):
+        for document in documents:
+            decode_messages(bson.decode(document)["messages"])
+    return (time.perf_counter() - start) / READ_ROUNDS / len(documents) * 1000
+def measure(label, chats):
+    """
+    Prints one table row comparing the legacy and compact documents of `chats`.
+    """
+    legacy_documents = [encode_document(chat_messages) for chat_messages in chats]
+    compact_documents = [
+        encode_document(encode_messages(chat_messages, storage_format="compact"))
+        for chat_messages in chats
+    ]
+    mismatches = sum(
+        decode_messages(bson.decode(document)["messages"]) != chat_messages
+        for document, chat_messages in zip(compact_documents, chats)
+    )
+
+    legacy_size = sum(map(len, legacy_documents))
+    compact_size = sum(map(len, compact_documents))
+    saved = (1 - compact_size / legacy_size) * 100
+    print(f"{label:>8} | {len(chats):>5} | {legacy_size:>12} | {compact_size:>13} | {saved:>5.1f}% | "
+          f"{time_read(legacy_documents):>14.3f} | {time_read(compact_documents):>15.3f}"
+          + (f"  ({mismatches} round-trip mismatches)" if mismatches else ""))
+def check_concurrent(chats):
+    """
+    Encodes and decodes chats from several threads at once and verifies every round trip.
+    Returns the number of failed round trips.
+    """
+    def round_trips(worker):
+        errors = 0
+        for round_index in range(CONCURRENT_ROUNDS):
+            chat_messages = chats[(worker + round_index) % len(chats)]
+            try:
+                compact_messages = encode_messages(chat_messages, storage_format="compact")
+                if decode_messages(compact_messages) != chat_messages:
+                    errors += 1
+            except Exception as e:
+                print("Concurrent round trip failed:", str(e))
+                errors += 1
+        return errors
+
+    with ThreadPoolExecutor(max_workers=CONCURRENT_THREADS) as executor:
+        return sum(executor.map(round_trips, range(CONCURRENT_THREADS)))
+def use_holdout_dictionary(contents):
+    """
+    Trains a dictionary without the held-out prompts, makes message_storage use it
+    and returns the held-out prompts.
+    """
+    training = [content for index, content in enumerate(contents) if index % HOLDOUT_EVERY]
+    holdout = [content for index, content in enumerate(contents) if not index % HOLDOUT_EVERY]
+
+    dictionary_path = os.path.join(tempfile.mkdtemp(), "holdout.dict")
+    with open(dictionary_path, "wb") as f:
+        f.write(train_dictionary(training).as_bytes())
+    message_storage.MESSAGE_DICTIONARY_PATH = dictionary_path
+
+    print(f"Dictionary trained on {len(training)} prompts, measuring on {len(holdout)} held-out prompts")
+    return holdout
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare legacy and compact message storage.")
+    parser.add_argument("--from-mongo", action="store_true",
+                        help="measure the chats stored in MONGO_URI with the deployed dictionary")
+    args = parser.parse_args()
+
+    if args.from_mongo:
+        print(f"Measuring stored chats with {message_storage.MESSAGE_DICTIONARY_PATH}")
+        rows = []
+        chats = []
+        for chat_messages in load_mongo_chats():
+            if chat_messages:
+                # Legacy documents as the app writes them today, with sequence numbers
+                chats.append([
+                    {"seq": msg.get("seq", index), "role": msg["role"], "content": msg["content"]}
+                    for index, msg in enumerate(chat_messages, start=1)
+                ])
+        for low, high in MONGO_BUCKETS:
+            bucket = [chat_messages for chat_messages in chats
+                      if low <= len(chat_messages) and (high is None or len(chat_messages) <= high)]
+            if bucket:
+                rows.append((f"{low}-{high}" if high else f"{low}+", bucket))
+        if chats:
+            rows.append(("all", chats))
+    else:
+        holdout = use_holdout_dictionary(load_corpus_messages())
+        chats = [build_chat(holdout, length) for length in CHAT_LENGTHS]
+        rows = [(str(length), [chat_messages]) for length, chat_messages in zip(CHAT_LENGTHS, chats)]
+
+    if not chats:
+        print("No chats to measure.")
+        raise SystemExit
+
+    print(f"Uncompressed tail: {MESSAGE_UNCOMPRESSED_TAIL} messages\n")
+    print(f"{'messages':>8} | {'chats':>5} | {'legacy bytes':>12} | {'compact bytes':>13} | {'saved':>6} | "
+          f"{'legacy read ms':>14} | {'compact read ms':>15}")
+    print("-" * 96)
+    for label, bucket in rows:
+        measure(label, bucket)
+
+    # Reported only: this is a measuring tool, the result does not change the exit status
+    errors = check_concurrent(chats)
+    print(f"\nConcurrent check: {CONCURRENT_THREADS} threads x {CONCURRENT_ROUNDS} chats, {errors} errors")
@@ -0,0 +1,175 @@
+import glob
+import os
+import threading
+import zstandard
+
+# Storage format for chat messages: "legacy" keeps {"role": ..., "content": ...} subdocuments,
+# "compact" encodes roles as small integers and compresses older message content with zstd.
+MESSAGE_STORAGE_FORMAT = os.getenv("MESSAGE_STORAGE_FORMAT", "legacy")
+
+# Number of most recent messages kept uncompressed so building the GPT context stays cheap
+MESSAGE_UNCOMPRESSED_TAIL = int(os.getenv("MESSAGE_UNCOMPRESSED_TAIL", 10))
+
+# Shared dictionary trained on our corpus (see train_message_dictionary.py), used to compress.
+# Every *.dict file next to it is loaded for decompression, so older dictionaries must be kept.
+MESSAGE_DICTIONARY_PATH = os.getenv("MESSAGE_DICTIONARY_PATH", "data/message_zstd.dict")
+MESSAGE_COMPRESSION_LEVEL = 19
+
+if MESSAGE_STORAGE_FORMAT not in ("legacy", "compact"):
+    raise ValueError("MESSAGE_STORAGE_FORMAT must be 'legacy' or 'compact'.")
+
+# Compact role codes. Never renumber: the codes are persisted in MongoDB.
+ROLE_CODES = {"system": 0, "user": 1, "assistant": 2}
+ROLE_NAMES = {code: role for role, code in ROLE_CODES.items()}
+
+# Dictionary files are read once and shared. zstd objects (compressors, decompressors and the
+# parsed dictionaries, which build their internal state lazily) must not be used by two threads
+# at once, so every waitress worker thread creates its own from the shared bytes.
+_dictionary_lock = threading.Lock()
+_dictionary_data = None
+_dictionary_data_by_id = None
+_local = threading.local()
+
+
+#
+#
+#zstd helpers
+#
+#
+def load_dictionary_data():
+    """
+    Reads the shared zstd dictionary (used to compress) once and caches its bytes.
+    """
+    global _dictionary_data
+    with _dictionary_lock:
+        if _dictionary_data is None:
+            with open(MESSAGE_DICTIONARY_PATH, "rb") as f:
+                _dictionary_data = f.read()
+        return _dictionary_data
+def load_dictionary_data_by_id():
+    """
+    Reads every *.dict file next to MESSAGE_DICTIONARY_PATH once, keyed by dictionary id.
+    """
+    global _dictionary_data_by_id
+    with _dictionary_lock:
+        if _dictionary_data_by_id is None:
+            dictionaries = {}
+            dictionary_dir = os.path.dirname(MESSAGE_DICTIONARY_PATH) or "."
+            for path in glob.glob(os.path.join(dictionary_dir, "*.dict")):
+                with open(path, "rb") as f:
+                    data = f.read()
+                dictionaries[zstandard.ZstdCompressionDict(data).dict_id()] = data
+            _dictionary_data_by_id = dictionaries
+        return _dictionary_data_by_id
+def get_compressor():
+    """
+    Returns the calling thread's compressor.
+    """
+    compressor = getattr(_local, "compressor", None)
+    if compressor is None:
+        compressor = zstandard.ZstdCompressor(
+            level=MESSAGE_COMPRESSION_LEVEL,
+            dict_data=zstandard.ZstdCompressionDict(load_dictionary_data()),
+            write_content_size=True,
+            write_checksum=False,
+            write_dict_id=True
+        )
+        _local.compressor = compressor
+    return compressor
+def get_decompressor(dict_id):
+    """
+    Returns the calling thread's decompressor for the dictionary a frame was written with.
+    """
+    decompressors = getattr(_local, "decompressors", None)
+    if decompressors is None:
+        decompressors = _local.decompressors = {}
+    if dict_id not in decompressors:
+        dictionaries = load_dictionary_data_by_id()
+        if dict_id not in dictionaries:
+            raise ValueError(f"No zstd dictionary found for dictionary id {dict_id}.")
+        decompressors[dict_id] = zstandard.ZstdDecompressor(
+            dict_data=zstandard.ZstdCompressionDict(dictionaries[dict_id])
+        )
+    return decompressors[dict_id]
+def compress_content(content):
+    """
+    Compresses message content with the shared dictionary.
+    Returns None when compression does not make the content smaller.
+    """
+    raw = content.encode("utf-8")
+    compressed = get_compressor().compress(raw)
+    if len(compressed) >= len(raw):
+        return None
+    return compressed
+def decompress_content(compressed):
+    compressed = bytes(compressed)
+    dict_id = zstandard.get_frame_parameters(compressed).dict_id
+    return get_decompressor(dict_id).decompress(compressed).decode("utf-8")
+
+
+#
+#
+#encode / decode
+#
+#
+def encode_message(msg, compress=False):
+    """
+    Encodes a {"seq", "role", "content"} message into the compact form:
+    {"s": seq, "r": role code, "c": content} or {"s": seq, "r": role code, "z": compressed content}.
+    """
+    encoded = {"r": ROLE_CODES[msg["role"]]}
+    if "seq" in msg:
+        encoded["s"] = msg["seq"]
+
+    compressed = compress_content(msg["content"]) if compress and msg["content"] else None
+    if compressed is not None:
+        encoded["z"] = compressed
+    else:
+        encoded["c"] = msg["content"]
+    return encoded
+def decode_message(stored):
+    """
+    Decodes a stored message back to {"seq", "role", "content"}.
+    Legacy messages (already using "role"/"content") are returned unchanged.
+    """
+    if "role" in stored:
+        return stored
+
+    msg = {}
+    if "s" in stored:
+        msg["seq"] = stored["s"]
+    msg["role"] = ROLE_NAMES[stored["r"]]
+    msg["content"] = decompress_content(stored["z"]) if "z" in stored else stored["c"]
+    return msg
+def encode_messages(chat_messages, stored_messages=(), storage_format=None, uncompressed_tail=None):
+    """
+    Prepares chat messages for storage in the configured format.
+    In compact format everything except the last `uncompressed_tail` messages is compressed.
+    Messages are append-only, so entries of `stored_messages` (the list read from the database)
+    that were already compressed, or already aged out but not worth compressing, are reused:
+    only messages that just left the uncompressed tail go through zstd.
+    """
+    storage_format = storage_format or MESSAGE_STORAGE_FORMAT
+    if storage_format != "compact":
+        return chat_messages
+
+    if uncompressed_tail is None:
+        uncompressed_tail = MESSAGE_UNCOMPRESSED_TAIL
+    compressed_count = max(len(chat_messages) - uncompressed_tail, 0)
+    stored_compressed_count = max(len(stored_messages) - uncompressed_tail, 0)
+
+    encoded = []
+    for index, msg in enumerate(chat_messages):
+        stored = stored_messages[index] if index < len(stored_messages) else {}
+        if "z" in stored or ("c" in stored and index < stored_compressed_count):
+            stored = dict(stored)
+            stored.setdefault("s", msg.get("seq"))
+            encoded.append(stored)
+        else:
+            encoded.append(encode_message(msg, compress=index < compressed_count))
+    return encoded
+def decode_messages(stored_messages):
+    """
+    Decodes stored chat messages, whatever format each one was written in.
+    """
+    return [decode_message(stored) for stored in stored_messages]
@@ -0,0 +1,101 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import zstandard
+from dotenv import load_dotenv
+
+# Trains a zstd dictionary for the compact message storage format.
+# Usage: python train_message_dictionary.py --output data/message_zstd_v2.dict [--from-mongo]
+#   --output      new dictionary file, must not exist yet
+#   --from-mongo  also samples real chat messages from MONGO_URI (recommended once we have traffic)
+#
+# IMPORTANT: compressed messages can only be read back with the dictionary that wrote them,
+# so existing dictionaries are never overwritten. Save the new one in the same directory as
+# MESSAGE_DICTIONARY_PATH, then point MESSAGE_DICTIONARY_PATH to it: old dictionaries stay
+# next to it and are still used to decode older messages.
+
+DICTIONARY_SIZE = 4096
+CORPUS_FILES = "data/prompts_to_azure_open_ai_train_*.jsonl"
+
+
+def load_corpus_messages():
+    """
+    Reads message contents from the training prompts (skipping comments and empty lines).
+    """
+    contents = []
+    for path in sorted(glob.glob(CORPUS_FILES)):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue
+                if msg.get("content"):
+                    contents.append(msg["content"])
+    return contents
+def load_mongo_chats(limit=1000):
+    """
+    Reads and decodes the messages of stored chats (legacy and compact formats).
+    """
+    from pymongo import MongoClient
+    from message_storage import decode_messages
+
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    chat_collection = client.get_database("chat_db").get_collection("chats")
+
+    return [
+        decode_messages(chat.get("messages", []))
+        for chat in chat_collection.find({}, {"messages": 1}).limit(limit)
+    ]
+def load_mongo_messages(limit=5000):
+    """
+    Reads message contents from stored chats.
+    """
+    contents = []
+    for chat_messages in load_mongo_chats():
+        contents += [msg["content"] for msg in chat_messages if msg["content"]]
+        if len(contents) >= limit:
+            break
+    return contents[:limit]
+def build_samples(contents):
+    """
+    Uses each message and each of its sentences as a sample,
+    our corpus is small and zstd needs many samples to train a useful dictionary.
+    """
+    samples = []
+    for content in contents:
+        samples.append(content.encode("utf-8"))
+        for sentence in re.split(r"(?<=[.!?])\s+", content):
+            if sentence:
+                samples.append(sentence.encode("utf-8"))
+    return samples
+def train_dictionary(contents):
+    samples = build_samples(contents)
+    print(f"Training dictionary on {len(samples)} samples ({sum(map(len, samples))} bytes)...")
+    return zstandard.train_dictionary(DICTIONARY_SIZE, samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a zstd dictionary for compact message storage.")
+    parser.add_argument("--output", required=True, help="new dictionary file, e.g. data/message_zstd_v2.dict")
+    parser.add_argument("--from-mongo", action="store_true", help="also sample real chat messages from MONGO_URI")
+    args = parser.parse_args()
+
+    if os.path.exists(args.output):
+        sys.exit(f"{args.output} already exists. Messages compressed with it could no longer be read, "
+                 "choose a new --output path.")
+
+    contents = load_corpus_messages()
+    if args.from_mongo:
+        contents += load_mongo_messages()
+    dictionary = train_dictionary(contents)
+
+    # "xb" also refuses to overwrite a file created since the check above
+    with open(args.output, "xb") as f:
+        f.write(dictionary.as_bytes())
+    print(f"Dictionary {dictionary.dict_id()} saved to {args.output}")
+    print(f"Set MESSAGE_DICTIONARY_PATH={args.output} to compress new messages with it.")